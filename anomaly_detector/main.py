@@ -5,6 +5,7 @@ from types import TracebackType
 from typing import Type, Optional, Any
 from pathlib import Path
 
+from anomaly_detector.reconciler import schedule_reconciler, merge_reconciled
 from anomaly_detector.reporter import anomaly_reporter
 from anomaly_detector.parser import XLSXLoanParser
 import typer
@@ -30,6 +31,8 @@ def main(
         file_path: str = typer.Option(default=False, envvar="FILE_PATH"),
         output_path: str = typer.Option(default=False, envvar="OUTPUT_PATH"),
         xirr_sensitivity: float = typer.Option(default=0.07, envvar="XIRR_SENSITIVITY"),
+        reconcile_schedule: bool = typer.Option(default=False, envvar="RECONCILE_SCHEDULE"),
+        schedule_tolerance: float = typer.Option(default=0.2, envvar="SCHEDULE_TOLERANCE"),
         dry_run: bool = typer.Option(default=False, envvar="DRY_RUN"),
         logging_format: str = typer.Option(
             default='[%(asctime)s] [%(threadName)s] %(levelname)s %(name)s - %(message)s',
@@ -45,7 +48,13 @@ def main(
     loan_parser = XLSXLoanParser()
 
     parsed_loans = loan_parser.parse_for(Path(file_path))
-    validated_issues = (parsed_loan.validate(xirr_sensitivity) for parsed_loan in parsed_loans)
+    if reconcile_schedule:
+        loans = list(parsed_loans)
+        reconciled_issues = schedule_reconciler(loans, schedule_tolerance)
+        validated_issues = (merge_reconciled(loan.validate(xirr_sensitivity), reconciled)
+                            for loan, reconciled in zip(loans, reconciled_issues))
+    else:
+        validated_issues = (parsed_loan.validate(xirr_sensitivity) for parsed_loan in parsed_loans)
     anomaly_reporter(validated_issues, Path(output_path), dry_run)
 
     elapsed = time.perf_counter() - start_time
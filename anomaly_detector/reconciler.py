@@ -0,0 +1,206 @@
+from itertools import chain, compress, repeat
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from anomaly_detector.parser import Issue, LoanRecord
+
+PRINCIPAL_CODE = 1
+INTEREST_CODE = 2
+RESCHEDULING_CODE = 3
+PAYMENT_TYPE_CODES: Dict[Any, int] = {
+    "principal": PRINCIPAL_CODE,
+    "interest": INTEREST_CODE,
+    "partial early repayment": RESCHEDULING_CODE,
+    "full early repayment": RESCHEDULING_CODE,
+    "repayment after agreement termination": RESCHEDULING_CODE,
+}
+PAID_CODE = 1
+PAYMENT_STATE_CODES: Dict[Any, int] = {
+    "paid on time": PAID_CODE,
+    "paid with delay": PAID_CODE,
+}
+UNKNOWN_CODE = 0
+NUMERIC_TYPES = {int, float, type(None)}
+
+
+def schedule_reconciler(loans: Sequence[LoanRecord], schedule_tolerance: float) -> List[List[Issue]]:
+    """Reconciles every loan against its expected annuity schedule in one batch.
+
+    Returns the reconciliation issues per loan, in the same order as ``loans``.
+    """
+    loan_amount = _float_column(loan.loan.loan_amount for loan in loans)
+    interest_rate = _float_column(loan.loan.interest_rate for loan in loans)
+    loan_term = _float_column(loan.loan.loan_term for loan in loans)
+    monthly_payment = _float_column(loan.repayment.monthly_payment for loan in loans)
+    repaid_principal = _float_column(loan.repayment.repaid_principal for loan in loans)
+
+    annuity = _annuity(loan_amount, interest_rate, loan_term)
+    instalment, paid_instalments, rescheduled = _payment_schedule(loans)
+    scheduled_principal = _scheduled_principal(loan_amount, interest_rate, loan_term, paid_instalments)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        payment_deviation = np.abs(monthly_payment - annuity) / annuity
+        instalment_deviation = np.abs(instalment - annuity) / annuity
+        principal_deviation = np.abs(repaid_principal - scheduled_principal) / loan_amount
+
+    payment_mismatch = (payment_deviation > schedule_tolerance) & ~rescheduled
+    instalment_mismatch = instalment_deviation > schedule_tolerance
+    principal_mismatch = principal_deviation > schedule_tolerance
+
+    issues: List[List[Issue]] = [[] for _ in loans]
+    for i in np.flatnonzero(payment_mismatch):
+        issues[i].append(Issue("SCHEDULE_PAYMENT_MISMATCH", "WARN", "monthly_payment",
+                               f"Monthly payment: {monthly_payment[i]}, annuity: {annuity[i]:.2f}, "
+                               f"deviation: {payment_deviation[i]:.2%}", float(monthly_payment[i])))
+    for i in np.flatnonzero(principal_mismatch):
+        issues[i].append(Issue("SCHEDULE_PRINCIPAL_MISMATCH", "WARN", "repaid_principal",
+                               f"Repaid principal: {repaid_principal[i]}, scheduled after "
+                               f"{int(paid_instalments[i])} paid instalments: {scheduled_principal[i]:.2f}, "
+                               f"deviation: {principal_deviation[i]:.2%}", float(repaid_principal[i])))
+    for i in np.flatnonzero(instalment_mismatch):
+        issues[i].append(Issue("SCHEDULE_INSTALMENT_MISMATCH", "WARN", "payments",
+                               f"Median instalment: {instalment[i]:.2f}, annuity: {annuity[i]:.2f}, "
+                               f"deviation: {instalment_deviation[i]:.2%}", float(instalment[i])))
+
+    return issues
+
+
+def merge_reconciled(validated: Dict[int, List[Issue]], reconciled: List[Issue]) -> Dict[int, List[Issue]]:
+    if not reconciled:
+        return validated
+
+    merged: Dict[int, List[Issue]] = {}
+    for loan_id, issues in validated.items():
+        merged[loan_id] = [issue for issue in issues if issue.severity != "CLEAN"] + reconciled
+    return merged
+
+
+def _float_column(values: Iterable[Any]) -> npt.NDArray[np.float64]:
+    """Numbers as float64, anything else (strings, bools, missing values) as NaN."""
+    column = list(values)
+    if set(map(type, column)) <= NUMERIC_TYPES:
+        return np.array(column, dtype=np.float64)
+    return np.fromiter(map(_as_float, column), dtype=np.float64, count=len(column))
+
+
+def _as_float(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+
+def _code_column(codes: Dict[Any, int], values: List[Any], default: int) -> npt.NDArray[np.int64]:
+    """Looks every value up in ``codes``; unknown and unhashable values get ``default``."""
+    try:
+        return np.fromiter(map(codes.get, values, repeat(default)), dtype=np.int64, count=len(values))
+    except TypeError:
+        return np.fromiter((_code(codes, value, default) for value in values), dtype=np.int64, count=len(values))
+
+
+def _field_codes(codes: Dict[Any, int], payments: List[Dict[str, Any]], key: str,
+                 default: int) -> npt.NDArray[np.int64]:
+    """Same as ``_code_column`` on the ``key`` field of every payment, without materializing the field."""
+    try:
+        return np.fromiter(map(codes.get, map(dict.get, payments, repeat(key)), repeat(default)),
+                           dtype=np.int64, count=len(payments))
+    except TypeError:
+        return _code_column(codes, list(map(dict.get, payments, repeat(key))), default)
+
+
+def _code(codes: Dict[Any, int], value: Any, default: int) -> int:
+    return codes.get(value, default) if _is_hashable(value) else default
+
+
+def _is_hashable(value: Any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _annuity(loan_amount: npt.NDArray[np.float64], interest_rate: npt.NDArray[np.float64],
+             loan_term: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    monthly_rate = interest_rate / 1200
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        discount = 1 - (1 + monthly_rate) ** -loan_term
+        annuity = np.where(monthly_rate == 0, loan_amount / loan_term, loan_amount * monthly_rate / discount)
+    annuity[(loan_amount <= 0) | (loan_term <= 0)] = np.nan
+    return annuity
+
+
+def _scheduled_principal(loan_amount: npt.NDArray[np.float64], interest_rate: npt.NDArray[np.float64],
+                         loan_term: npt.NDArray[np.float64],
+                         paid_instalments: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """Principal the annuity schedule has repaid after ``paid_instalments`` instalments."""
+    monthly_rate = interest_rate / 1200
+    instalments = np.minimum(paid_instalments, loan_term)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        growth = np.log1p(monthly_rate)
+        repaid_share = np.where(monthly_rate == 0, instalments / loan_term,
+                                np.expm1(instalments * growth) / np.expm1(loan_term * growth))
+    scheduled_principal = loan_amount * repaid_share
+    scheduled_principal[(loan_amount <= 0) | (loan_term <= 0)] = np.nan
+    return scheduled_principal
+
+
+def _payment_schedule(loans: Sequence[LoanRecord]) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64],
+                                                            npt.NDArray[np.bool_]]:
+    """Median amount due per payment date (principal + interest), number of paid principal instalments and
+    which loans were rescheduled.
+
+    Loans without a valid payments list, or rescheduled by an early repayment or a termination, no longer
+    follow their original annuity and are left as NaN.
+    """
+    payment_lists = [loan.repayment.payments if isinstance(loan.repayment.payments, list) else [] for loan in loans]
+    payments = list(chain.from_iterable(payment_lists))
+    median = np.full(len(loans), np.nan)
+    paid_instalments = np.full(len(loans), np.nan)
+
+    loan_index = np.repeat(np.arange(len(loans)), [len(payment_list) for payment_list in payment_lists])
+    type_codes = _field_codes(PAYMENT_TYPE_CODES, payments, "Type", UNKNOWN_CODE)
+
+    rescheduled = np.zeros(len(loans), dtype=bool)
+    rescheduled[loan_index[type_codes == RESCHEDULING_CODE]] = True
+    scheduled = np.array([isinstance(loan.repayment.payments, list) for loan in loans], dtype=bool) & ~rescheduled
+
+    principal_rows = (type_codes == PRINCIPAL_CODE) & scheduled[loan_index]
+    principal_payments = list(compress(payments, principal_rows.tolist()))
+    paid = _field_codes(PAYMENT_STATE_CODES, principal_payments, "State", UNKNOWN_CODE) == PAID_CODE
+    paid_counts = np.bincount(loan_index[principal_rows][paid], minlength=len(loans))
+    paid_instalments[scheduled] = paid_counts[scheduled]
+
+    instalment_rows = ((type_codes == PRINCIPAL_CODE) | (type_codes == INTEREST_CODE)) & scheduled[loan_index]
+    instalment_payments = list(compress(payments, instalment_rows.tolist()))
+    payment_dates = list(map(dict.get, instalment_payments, repeat("Payment date")))
+    try:
+        distinct_dates = set(payment_dates)
+    except TypeError:
+        distinct_dates = {payment_date for payment_date in payment_dates if _is_hashable(payment_date)}
+    date_ids = {payment_date: i for i, payment_date in enumerate(distinct_dates - {None, ""})}
+    date_codes = _code_column(date_ids, payment_dates, -1)
+    amounts = _float_column(map(dict.get, instalment_payments, repeat("Amount")))
+
+    keep = (date_codes >= 0) & ~np.isnan(amounts)
+    if not keep.any():
+        return median, paid_instalments, rescheduled
+
+    date_codes = date_codes[keep]
+    amounts = amounts[keep]
+    index = loan_index[instalment_rows][keep]
+    width = len(date_ids)
+    keys, group = np.unique(index * width + date_codes, return_inverse=True)
+    group_amount = np.bincount(group, weights=amounts)
+    group_loan = keys // width
+
+    order = np.lexsort((group_amount, group_loan))
+    sorted_amount = group_amount[order]
+    counts = np.bincount(group_loan, minlength=len(loans))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_instalments = counts > 0
+    lower = starts[has_instalments] + (counts[has_instalments] - 1) // 2
+    upper = starts[has_instalments] + counts[has_instalments] // 2
+    median[has_instalments] = (sorted_amount[lower] + sorted_amount[upper]) / 2
+    return median, paid_instalments, rescheduled
@@ -0,0 +1,289 @@
+import csv
+import random
+import timeit
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+from openpyxl import Workbook
+from typer.testing import CliRunner
+
+from anomaly_detector.main import app
+from anomaly_detector.parser import BORROWER_MAP, LOAN_MAP, REPAYMENT_MAP, COMPANY_MAP, COLLATERAL_MAP
+from anomaly_detector.parser import XLSXLoanParser
+from anomaly_detector.reconciler import schedule_reconciler
+from anomaly_detector.reporter import anomaly_reporter
+
+runner = CliRunner()
+
+XIRR_SENSITIVITY = 0.07
+SEEDS = [7, 42, 1234]
+EQUIVALENCE_ROWS = 300
+THROUGHPUT_ROWS = 1000
+BENCHMARK_ROUNDS = 3
+
+REFERENCE_MIN_ROWS_PER_SECOND = 100
+# A mode may add checks on top of the reference, but must keep at least this share of the reference throughput.
+MODE_MIN_RELATIVE_SPEED = 0.8
+# Time budget for reconciling a 20,000-loan batch, assuming a single CPU core. One core takes about 1.8s for the
+# batch (about 11k loans/s, so 300k loans take about 25s); the budget leaves headroom for slower or loaded machines.
+RECONCILER_BATCH_REPEATS = 20
+RECONCILER_MAX_SECONDS = 4.0
+
+# Extra CLI options per optional mode, and the issue codes only that mode adds on top of the reference.
+MODES: Dict[str, Tuple[List[str], List[str]]] = {
+    "reconcile-schedule": (
+        ["--reconcile-schedule"],
+        ["SCHEDULE_PAYMENT_MISMATCH", "SCHEDULE_INSTALMENT_MISMATCH", "SCHEDULE_PRINCIPAL_MISMATCH"],
+    ),
+}
+MODE_CODES = {code for _, mode_codes in MODES.values() for code in mode_codes}
+# Seeded anomalies that change the loan's annuity, so any mode code may follow from them.
+SCHEDULE_ALTERING_CODES = {"XIRRDeviation"}
+
+HEADERS = [*BORROWER_MAP, *LOAN_MAP, *REPAYMENT_MAP, *COMPANY_MAP, *COLLATERAL_MAP]
+
+ReportRow = Tuple[str, str, str, str, str, str]
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, min(day.day, 28))
+
+
+def _loan_row(rng: random.Random, loan_id: int, seeded: Counter[str]) -> Dict[str, Any]:
+    """Generates one loan following its annuity schedule and counts the issues seeded into it."""
+    loan_amount = float(rng.randrange(500, 50000, 50))
+    interest_rate = float(rng.randrange(5, 26))
+    loan_term = rng.randrange(6, 37)
+    disbursal_date = date(2020, 1, 1) + timedelta(days=rng.randrange(0, 1000))
+
+    monthly_rate = interest_rate / 1200
+    annuity = loan_amount * monthly_rate / (1 - (1 + monthly_rate) ** -loan_term)
+    paid_instalments = rng.randrange(0, loan_term + 1)
+    late_instalment = rng.randrange(1, loan_term + 1) if rng.random() < 0.1 else None
+
+    payments: List[Dict[str, Any]] = []
+    balance = loan_amount
+    repaid_principal = 0.0
+    for k in range(1, loan_term + 1):
+        interest = round(balance * monthly_rate, 2)
+        principal = round(balance if k == loan_term else annuity - interest, 2)
+        balance -= principal
+        due_date = _add_months(disbursal_date, k)
+        payment_date = due_date + timedelta(days=120) if k == late_instalment else due_date
+        for payment_type, amount in (("principal", principal), ("interest", interest)):
+            payments.append({"Loan ID": str(loan_id), "Payment date": payment_date.strftime("%d/%m/%Y"),
+                             "Repayment date": due_date.strftime("%d/%m/%Y"), "Type": payment_type,
+                             "State": "paid on time" if k <= paid_instalments else "pending", "Amount": amount})
+        if k <= paid_instalments:
+            repaid_principal += principal
+    if late_instalment is not None:
+        seeded["DEFAULT"] += 2
+
+    row: Dict[str, Any] = {
+        "borrower id": loan_id + 1, "birth year": rng.randrange(1950, 2000), "gender": rng.choice(["male", "female"]),
+        "children": rng.randrange(0, 4), "months at current employer": rng.randrange(0, 120),
+        "years working total": rng.randrange(0, 40), "borrower income": float(rng.randrange(500, 5000)),
+        "borrower liabilities": float(rng.randrange(0, 1000)), "dti": round(rng.random(), 2),
+        "loan id": loan_id, "credit score": rng.choice("ABCD"), "loan amount": loan_amount,
+        "disbursal date": disbursal_date, "interest rate": interest_rate, "loan term": loan_term,
+        "loan type": "instalment", "loan status": "granted",
+        "monthly payment": round(annuity, 2), "repaid principal": round(repaid_principal, 2),
+        "outstanding principal": round(loan_amount - repaid_principal, 2), "days late": 0,
+        "payments": str(payments),
+        "number of employees": rng.randrange(1, 500), "annual revenue": float(rng.randrange(0, 10 ** 6)),
+        "collateral market value": float(rng.randrange(1000, 10 ** 5)),
+        "appraisal date": disbursal_date.strftime("%d.%m.%Y"),
+    }
+
+    anomaly = rng.choice([None, None, None, "NEGATIVE_VALUE", "DTI_NEGATIVE", "AMOUNT_NONPOSITIVE", "INVALID_DATE",
+                          "NEGATIVE_DAYS_LATE", "NON_COMPLETE_PAYMENTS", "NEGATIVE_EMPLOYEES", "NEGATIVE_REVENUE",
+                          "COLLATERAL_NONPOSITIVE", "XIRRDeviation", "SCHEDULE_PAYMENT_MISMATCH",
+                          "SCHEDULE_INSTALMENT_MISMATCH", "SCHEDULE_PRINCIPAL_MISMATCH"])
+    if anomaly == "NEGATIVE_VALUE":
+        row["borrower income"] = -row["borrower income"] - 1
+    elif anomaly == "DTI_NEGATIVE":
+        row["dti"] = -row["dti"] - 0.1
+    elif anomaly == "AMOUNT_NONPOSITIVE":
+        row["loan amount"] = 0.0
+    elif anomaly == "INVALID_DATE":
+        row["appraisal date"] = "31/31/2020"
+    elif anomaly == "NEGATIVE_DAYS_LATE":
+        row["days late"] = -rng.randrange(1, 30)
+    elif anomaly == "NON_COMPLETE_PAYMENTS":
+        row["payments"] = row["payments"][:-10]
+        seeded.pop("DEFAULT", None)
+    elif anomaly == "NEGATIVE_EMPLOYEES":
+        row["number of employees"] = -1
+    elif anomaly == "NEGATIVE_REVENUE":
+        row["annual revenue"] = -1.0
+    elif anomaly == "COLLATERAL_NONPOSITIVE":
+        row["collateral market value"] = 0.0
+    elif anomaly == "XIRRDeviation":
+        row["interest rate"] = interest_rate + 20
+    elif anomaly == "SCHEDULE_PAYMENT_MISMATCH":
+        row["monthly payment"] = round(annuity * 1.5, 2)
+    elif anomaly == "SCHEDULE_INSTALMENT_MISMATCH":
+        # Interest paid a day before the principal splits every instalment in two, halving the median amount.
+        for payment in payments:
+            if payment["Type"] == "interest":
+                paid_on = datetime.strptime(payment["Payment date"], "%d/%m/%Y") - timedelta(days=1)
+                payment["Payment date"] = paid_on.strftime("%d/%m/%Y")
+        row["payments"] = str(payments)
+    elif anomaly == "SCHEDULE_PRINCIPAL_MISMATCH":
+        shift = loan_amount / 2 if repaid_principal < loan_amount / 2 else -loan_amount / 2
+        row["repaid principal"] = round(repaid_principal + shift, 2)
+    if anomaly is not None:
+        seeded[anomaly] += 1
+
+    return row
+
+
+def generate_tape(path: Path, rows: int, seed: int) -> Dict[str, Counter[str]]:
+    """Writes a loan tape with randomly seeded anomalies and returns the issues seeded per loan id."""
+    rng = random.Random(seed)
+    seeded: Dict[str, Counter[str]] = {}
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([header.title() for header in HEADERS])
+    for i in range(rows):
+        loan_id = 10 ** 7 + i
+        seeded[str(loan_id)] = Counter()
+        row = _loan_row(rng, loan_id, seeded[str(loan_id)])
+        sheet.append([row.get(header, "") for header in HEADERS])
+    workbook.save(path)
+
+    return seeded
+
+
+def _read_report(output_path: Path) -> List[ReportRow]:
+    with open(output_path, mode="r", newline="", encoding="utf-8") as csv_file:
+        return [(row["loan_id"], row["severity"], row["code"], row["field"], row["message"], row["value"])
+                for row in csv.DictReader(csv_file)]
+
+
+def _codes_per_loan(report: List[ReportRow]) -> Dict[str, Counter[str]]:
+    codes: Dict[str, Counter[str]] = {}
+    for loan_id, _, code, *_ in report:
+        codes.setdefault(loan_id, Counter())[code] += 1
+    return codes
+
+
+def _reference_report(tape: Path, output_path: Path) -> List[ReportRow]:
+    parsed_loans = XLSXLoanParser().parse_for(tape)
+    validated_issues = (parsed_loan.validate(XIRR_SENSITIVITY) for parsed_loan in parsed_loans)
+    anomaly_reporter(validated_issues, output_path)
+    return _read_report(output_path)
+
+
+def _mode_report(tape: Path, output_path: Path, mode: str) -> List[ReportRow]:
+    options, _ = MODES[mode]
+    result = runner.invoke(app, ["--file-path", str(tape), "--output-path", str(output_path),
+                                 "--xirr-sensitivity", str(XIRR_SENSITIVITY), *options])
+    assert result.exit_code == 0, result.output
+    return _read_report(output_path)
+
+
+def _without_mode_codes(report: List[ReportRow], mode: str) -> Counter[ReportRow]:
+    """Drops the issues only the mode reports, restoring the CLEAN row of loans left without issues."""
+    _, mode_codes = MODES[mode]
+    loan_ids = dict.fromkeys(row[0] for row in report)
+    remaining = [row for row in report if row[2] not in mode_codes]
+    remaining_ids = {row[0] for row in remaining}
+    remaining += [(loan_id, "CLEAN", "", "", "", "") for loan_id in loan_ids if loan_id not in remaining_ids]
+    return Counter(remaining)
+
+
+def _best_seconds(benchmark: Any, run: Callable[[], Any]) -> float:
+    benchmark.pedantic(run, rounds=BENCHMARK_ROUNDS, iterations=1)
+    seconds: float = benchmark.stats["min"]
+    return seconds
+
+
+def _rows_per_second(benchmark: Any, rows: int, run: Callable[[], Any]) -> float:
+    rows_per_second = rows / _best_seconds(benchmark, run)
+    benchmark.extra_info["rows_per_second"] = rows_per_second
+    return rows_per_second
+
+
+@pytest.fixture(scope="module", params=SEEDS)
+def seeded_tape(request: pytest.FixtureRequest,
+                tmp_path_factory: pytest.TempPathFactory) -> Tuple[Path, Dict[str, Counter[str]]]:
+    tape = tmp_path_factory.mktemp("tapes") / f"loans_{request.param}.xlsx"
+    seeded = generate_tape(tape, EQUIVALENCE_ROWS, request.param)
+    return tape, seeded
+
+
+@pytest.fixture(scope="module")
+def throughput_tape(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    tape = tmp_path_factory.mktemp("tapes") / "loans_throughput.xlsx"
+    generate_tape(tape, THROUGHPUT_ROWS, 0)
+    return tape
+
+
+@pytest.fixture(scope="module")
+def reference_rows_per_second(throughput_tape: Path, tmp_path_factory: pytest.TempPathFactory) -> float:
+    """Reference throughput the modes are compared to, measured once per module whatever tests are selected."""
+    output_path = tmp_path_factory.mktemp("reference") / "anomaly_report.csv"
+    seconds = timeit.repeat(lambda: _reference_report(throughput_tape, output_path), number=1, repeat=BENCHMARK_ROUNDS)
+    return THROUGHPUT_ROWS / min(seconds)
+
+
+@pytest.fixture()
+def output_path(tmp_path: Path) -> Path:
+    return tmp_path / "anomaly_report.csv"
+
+
+def test_reference_detects_seeded_anomalies(seeded_tape: Tuple[Path, Dict[str, Counter[str]]],
+                                            output_path: Path) -> None:
+    tape, seeded = seeded_tape
+    reference = _codes_per_loan(_reference_report(tape, output_path))
+
+    expected = {loan_id: Counter({code: count for code, count in codes.items() if code not in MODE_CODES})
+                for loan_id, codes in seeded.items()}
+    assert reference == {loan_id: codes or Counter({"": 1}) for loan_id, codes in expected.items()}
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_mode_matches_reference(seeded_tape: Tuple[Path, Dict[str, Counter[str]]], output_path: Path,
+                                mode: str) -> None:
+    tape, seeded = seeded_tape
+    reference = Counter(_reference_report(tape, output_path))
+    report = _mode_report(tape, output_path, mode)
+
+    assert _without_mode_codes(report, mode) == reference
+
+    _, mode_codes = MODES[mode]
+    reported = _codes_per_loan(report)
+    for loan_id, codes in seeded.items():
+        expected = {code for code in codes if code in mode_codes}
+        found = {code for code in reported[loan_id] if code in mode_codes}
+        if codes.keys() & SCHEDULE_ALTERING_CODES:
+            assert expected <= found, loan_id
+        else:
+            assert found == expected, loan_id
+
+
+def test_reference_throughput(benchmark: Any, throughput_tape: Path, output_path: Path) -> None:
+    rows_per_second = _rows_per_second(benchmark, THROUGHPUT_ROWS,
+                                       lambda: _reference_report(throughput_tape, output_path))
+    assert rows_per_second >= REFERENCE_MIN_ROWS_PER_SECOND
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_mode_throughput(benchmark: Any, throughput_tape: Path, output_path: Path, mode: str,
+                         reference_rows_per_second: float) -> None:
+    rows_per_second = _rows_per_second(benchmark, THROUGHPUT_ROWS,
+                                       lambda: _mode_report(throughput_tape, output_path, mode))
+    assert rows_per_second >= MODE_MIN_RELATIVE_SPEED * reference_rows_per_second
+
+
+def test_schedule_reconciler_throughput(benchmark: Any, throughput_tape: Path) -> None:
+    loans = list(XLSXLoanParser().parse_for(throughput_tape)) * RECONCILER_BATCH_REPEATS
+    seconds = _best_seconds(benchmark, lambda: schedule_reconciler(loans, 0.2))
+    benchmark.extra_info["rows_per_second"] = len(loans) / seconds
+    assert seconds <= RECONCILER_MAX_SECONDS
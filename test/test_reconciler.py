@@ -0,0 +1,151 @@
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+from anomaly_detector.parser import BorrowerInfo, CollateralInfo, CompanyInfo, LoanInfo, LoanRecord, RepaymentInfo
+from anomaly_detector.reconciler import schedule_reconciler, merge_reconciled
+
+
+def _loan(loan_amount: Any = 1200.0, interest_rate: Any = 0.0, loan_term: Any = 12, monthly_payment: Any = None,
+          repaid_principal: Any = None, payments: Any = None) -> LoanRecord:
+    return LoanRecord(
+        borrower=BorrowerInfo(borrower_id=1),
+        loan=LoanInfo(loan_id=1, loan_amount=loan_amount, interest_rate=interest_rate, loan_term=loan_term),
+        repayment=RepaymentInfo(monthly_payment=monthly_payment, repaid_principal=repaid_principal, payments=payments),
+        company=CompanyInfo(),
+        collateral=CollateralInfo(),
+    )
+
+
+def _instalment(month: int, principal: Any, interest: Any, state: str = "paid on time",
+                payment_date: Optional[Any] = None) -> List[Dict[str, Any]]:
+    payment_date = payment_date if payment_date is not None else f"15/{month:02d}/2024"
+    return [{"Payment date": payment_date, "Type": "principal", "State": state, "Amount": principal},
+            {"Payment date": payment_date, "Type": "interest", "State": state, "Amount": interest}]
+
+
+def _codes(loan: LoanRecord, schedule_tolerance: float = 0.2) -> List[str]:
+    return [issue.code for issue in schedule_reconciler([loan], schedule_tolerance)[0]]
+
+
+def test_zero_interest_annuity() -> None:
+    assert _codes(_loan(monthly_payment=100.0)) == []
+
+    [issue] = schedule_reconciler([_loan(monthly_payment=130.0)], 0.2)[0]
+    assert issue.code == 'SCHEDULE_PAYMENT_MISMATCH'
+    assert issue.severity == 'WARN'
+    assert issue.message == 'Monthly payment: 130.0, annuity: 100.00, deviation: 30.00%'
+    assert issue.value == 130.0
+
+
+def test_annuity() -> None:
+    assert _codes(_loan(loan_amount=10000.0, interest_rate=12.0, monthly_payment=888.49), 0.001) == []
+
+    [issue] = schedule_reconciler([_loan(loan_amount=10000.0, interest_rate=12.0, monthly_payment=1100.0)], 0.2)[0]
+    assert issue.message == 'Monthly payment: 1100.0, annuity: 888.49, deviation: 23.81%'
+
+
+def test_median_instalment() -> None:
+    odd = _instalment(1, 95.0, 5.0) + _instalment(2, 96.0, 4.0) + _instalment(3, 170.0, 10.0)
+    assert _codes(_loan(payments=odd), 0.05) == []
+
+    even = _instalment(1, 95.0, 5.0) + _instalment(2, 96.0, 4.0)
+    even += _instalment(3, 117.0, 3.0) + _instalment(4, 138.0, 2.0)
+    [issue] = schedule_reconciler([_loan(payments=even)], 0.05)[0]
+    assert issue.code == 'SCHEDULE_INSTALMENT_MISMATCH'
+    assert issue.message == 'Median instalment: 110.00, annuity: 100.00, deviation: 10.00%'
+
+
+def test_rescheduled_loan_is_skipped() -> None:
+    payments = _instalment(1, 300.0, 0.0) + _instalment(2, 300.0, 0.0)
+    assert _codes(_loan(repaid_principal=600.0, payments=payments)) == [
+        'SCHEDULE_PRINCIPAL_MISMATCH', 'SCHEDULE_INSTALMENT_MISMATCH'
+    ]
+
+    payments.append({"Payment date": "15/03/2024", "Type": "full early repayment", "State": "paid on time",
+                     "Amount": 600.0})
+    assert _codes(_loan(repaid_principal=1200.0, payments=payments)) == []
+    assert _codes(_loan(monthly_payment=300.0, repaid_principal=1200.0, payments=payments)) == []
+
+
+def test_scheduled_principal() -> None:
+    payments = [_instalment(month, 100.0, 0.0)[0] for month in range(1, 4)]
+    payments += [_instalment(month, 100.0, 0.0, state="pending")[0] for month in range(4, 13)]
+    assert _codes(_loan(repaid_principal=300.0, payments=payments)) == []
+
+    [issue] = schedule_reconciler([_loan(repaid_principal=900.0, payments=payments)], 0.2)[0]
+    assert issue.code == 'SCHEDULE_PRINCIPAL_MISMATCH'
+    assert issue.field == 'repaid_principal'
+    assert issue.message == 'Repaid principal: 900.0, scheduled after 3 paid instalments: 300.00, deviation: 50.00%'
+
+    # 10000 at 12% over 12 months repays 10000 * (1.01 ** 6 - 1) / (1.01 ** 12 - 1) = 4850.80 in six instalments.
+    payments = [_instalment(month, 888.49, 0.0)[0] for month in range(1, 7)]
+    assert _codes(_loan(loan_amount=10000.0, interest_rate=12.0, repaid_principal=4850.80, payments=payments),
+                  0.001) == []
+    assert _codes(_loan(loan_amount=10000.0, interest_rate=12.0, repaid_principal=5000.0, payments=payments),
+                  0.001) == ['SCHEDULE_PRINCIPAL_MISMATCH']
+
+
+def test_nonpositive_loan_amount_is_skipped() -> None:
+    payments = [_instalment(month, 100.0, 0.0)[0] for month in range(1, 4)]
+    assert _codes(_loan(loan_amount=0.0, monthly_payment=100.0, repaid_principal=300.0, payments=payments)) == []
+    assert _codes(_loan(loan_amount=-1200.0, monthly_payment=100.0, repaid_principal=300.0, payments=payments)) == []
+
+
+def test_non_numeric_values_are_ignored() -> None:
+    assert _codes(_loan(loan_amount="Not Valid float", monthly_payment=500.0)) == []
+    assert _codes(_loan(monthly_payment="Not Valid float", repaid_principal=True)) == []
+    assert _codes(_loan(loan_term="Not Valid int", monthly_payment=500.0)) == []
+
+    string_amounts = _loan(payments=_instalment(1, "200", "0") + _instalment(2, "200", "0"))
+    missing_amounts = _loan(payments=_instalment(1, "n/a", None) + _instalment(2, None, "n/a"))
+    assert schedule_reconciler([string_amounts], 0.2) == [[]]
+    assert schedule_reconciler([string_amounts, missing_amounts], 0.2) == [[], []]
+
+    numeric_amounts = _loan(payments=_instalment(1, 200.0, 0.0) + _instalment(2, 200.0, 0.0))
+    assert _codes(numeric_amounts) == ['SCHEDULE_INSTALMENT_MISMATCH']
+    assert [issue.code for issue in schedule_reconciler([numeric_amounts, missing_amounts], 0.2)[0]] == [
+        'SCHEDULE_INSTALMENT_MISMATCH'
+    ]
+
+
+def test_unhashable_payment_fields() -> None:
+    payments = _instalment(1, 100.0, 0.0) + _instalment(2, 100.0, 0.0, payment_date=["15/02/2024"])
+    payments.append({"Payment date": "15/03/2024", "Type": ["principal"], "State": {"paid"}, "Amount": 100.0})
+    assert schedule_reconciler([_loan(repaid_principal=100.0, payments=payments)], 0.2) == [[]]
+
+
+def test_schedule_reconciler(parsed_loans: Iterator[LoanRecord]) -> None:
+    loans = list(parsed_loans)
+    reconciled_issues = schedule_reconciler(loans, 0.2)
+
+    assert len(reconciled_issues) == 72
+    assert Counter(issue.code for issues in reconciled_issues for issue in issues) == {
+        "SCHEDULE_PAYMENT_MISMATCH": 2,
+        "SCHEDULE_PRINCIPAL_MISMATCH": 2,
+        "SCHEDULE_INSTALMENT_MISMATCH": 2,
+    }
+
+    mismatches = {loan.loan.loan_id: issues for loan, issues in zip(loans, reconciled_issues) if issues}
+    assert 37216892 not in mismatches
+    assert mismatches[35612451][0].field == 'monthly_payment'
+    assert mismatches[35612451][0].severity == 'WARN'
+    assert mismatches[35612451][0].message == 'Monthly payment: 208.0, annuity: 168.33, deviation: 23.57%'
+    assert mismatches[65318525][0].field == 'repaid_principal'
+    assert mismatches[65318525][0].message == ('Repaid principal: 5850.0, scheduled after 10 paid instalments: '
+                                               '852.76, deviation: 85.42%')
+    assert mismatches[94273288][1].field == 'payments'
+    assert mismatches[94273288][1].message == 'Median instalment: 9132.34, annuity: 6734.03, deviation: 35.61%'
+
+
+def test_merge_reconciled(parsed_loans: Iterator[LoanRecord]) -> None:
+    loans = list(parsed_loans)
+    reconciled_issues = schedule_reconciler(loans, 0.2)
+
+    merged = [merge_reconciled(loan.validate(0.07), reconciled) for loan, reconciled in zip(loans, reconciled_issues)]
+    clean_loans = [issues for issues_per_loan in merged for issues in issues_per_loan.values()
+                   if issues[0].severity == 'CLEAN']
+
+    assert len(clean_loans) == 29
+    assert all(len(issues) == 1 for issues in clean_loans)
+    assert [issue.code for issue in merged[41][96227257]] == ['SCHEDULE_INSTALMENT_MISMATCH']
+    assert [issue.code for issue in merged[47][35612451]] == ['NON_COMPLETE_PAYMENTS', 'SCHEDULE_PAYMENT_MISMATCH']